@@ -10,11 +10,447 @@ bl_info = {
 import bpy
 import os
 import urllib.request
+import http.client
 import json
 import mathutils
 import gzip
 from io import BytesIO
 import base64
+import math
+import numpy as np
+import concurrent.futures
+import random
+import threading
+import time
+
+# Timeouts for the SD backend, in seconds
+SD_QUERY_TIMEOUT = 10.0
+SD_TIMEOUT_FACTOR = 3.0
+SD_TIMEOUT_OVERHEAD = 30.0
+SD_MODEL_LOAD_TIMEOUT = 120.0
+SD_CHECKPOINT_MAX_AGE = 60.0
+SD_MAX_TIMEOUT = 1800.0
+SD_TRANSIENT_HTTP_CODES = (502, 503, 504)
+
+
+class SdBackendError(Exception):
+    """Raised when the SD backend cannot serve a request."""
+
+
+class SdCircuitOpenError(SdBackendError):
+    """Raised without contacting the backend while the circuit is open."""
+
+
+class SdTimeoutError(SdBackendError):
+    """Raised when the webui took the request but did not answer in time."""
+
+
+class SdLatencyModel:
+    """
+    Estimate generation time from steps and resolution.
+
+    The cost of one step on one megapixel is learned from past requests with
+    an exponential moving average.
+    """
+
+    def __init__(self, seconds_per_megapixel_step=0.5, smoothing=0.3):
+        self.seconds_per_megapixel_step = seconds_per_megapixel_step
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+
+    def work(self, steps, width, height):
+        return max(steps, 1) * max(width * height, 1) / 1e6
+
+    def estimate(self, steps, width, height):
+        with self.lock:
+            return self.seconds_per_megapixel_step * self.work(steps, width, height)
+
+    def record(self, steps, width, height, seconds):
+        sample = seconds / self.work(steps, width, height)
+        with self.lock:
+            self.seconds_per_megapixel_step += self.smoothing * (
+                sample - self.seconds_per_megapixel_step
+            )
+
+    def record_timeout(self, steps, width, height, seconds):
+        """
+        Record a request that was still running after seconds. That time is
+        a lower bound, so the estimate is raised to it but never lowered.
+        """
+        sample = seconds / self.work(steps, width, height)
+        with self.lock:
+            self.seconds_per_megapixel_step = max(
+                self.seconds_per_megapixel_step, sample
+            )
+
+    def timeout(self, steps, width, height, queued=1, model_load=False):
+        """
+        Timeout for a request that waits behind queued - 1 others, with extra
+        time when the webui has to load a checkpoint first.
+        """
+        expected = self.estimate(steps, width, height) * max(queued, 1)
+        overhead = SD_TIMEOUT_OVERHEAD + (SD_MODEL_LOAD_TIMEOUT if model_load else 0.0)
+        return min(overhead + SD_TIMEOUT_FACTOR * expected, SD_MAX_TIMEOUT)
+
+
+class SdCircuitBreaker:
+    """
+    Fail fast while the backend is down.
+
+    After failure_threshold consecutive failures the circuit opens and
+    requests are refused for reset_timeout seconds. Then a single trial
+    request is let through and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def retry_in(self):
+        """Seconds until a trial request is allowed, 0 when closed."""
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(self.opened_at + self.reset_timeout - self.clock(), 0.0)
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - self.clock()
+            if remaining > 0 or self.trial_running:
+                raise SdCircuitOpenError(
+                    f"SD backend is unavailable, retrying in {max(remaining, 0):.0f} s."
+                )
+            self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self.trial_running = False
+
+
+def checkpoint_key(title):
+    """
+    Split a checkpoint title like "dir/model.safetensors [0123456789]" into
+    the model name without folder and extension, and the short hash.
+    """
+    name, _, short_hash = title.partition(" [")
+    name = name.replace("\\", "/").rsplit("/", 1)[-1]
+    for extension in (".safetensors", ".ckpt"):
+        if name.endswith(extension):
+            name = name[: -len(extension)]
+    return name, short_hash.rstrip("]")
+
+
+def checkpoint_matches(loaded, wanted):
+    """
+    Compare checkpoint titles by hash when both have one, otherwise by name.
+    """
+    if not loaded or not wanted:
+        return False
+    loaded_name, loaded_hash = checkpoint_key(loaded)
+    wanted_name, wanted_hash = checkpoint_key(wanted)
+    if loaded_hash and wanted_hash:
+        return loaded_hash == wanted_hash
+    return loaded_name == wanted_name
+
+
+def group_by_checkpoint(jobs, loaded_checkpoint):
+    """
+    Group (checkpoint, job) pairs so every checkpoint is loaded only once,
+    starting with the one the webui already has loaded.
+
+    :return: List of (checkpoint, [job, ...]) in submission order.
+    """
+    groups = {}
+    for checkpoint, job in jobs:
+        groups.setdefault(checkpoint, []).append(job)
+    return sorted(
+        groups.items(),
+        key=lambda item: not checkpoint_matches(loaded_checkpoint, item[0]),
+    )
+
+
+class SdBackend:
+    """
+    Access to one stable-diffusion-webui instance with adaptive timeouts,
+    retries with exponential backoff and a circuit breaker.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        max_retries=3,
+        backoff=1.0,
+        max_backoff=30.0,
+        breaker=None,
+        sleep=time.sleep,
+    ):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker if breaker is not None else SdCircuitBreaker()
+        self.latency = SdLatencyModel()
+        self.sleep = sleep
+        self.in_flight = 0
+        self.checkpoint = None
+        self.checkpoint_checked_at = None
+        self.lock = threading.Lock()
+
+    def request(self, path, data=None, timeout=SD_QUERY_TIMEOUT, timings=None):
+        """
+        Send a GET, or a POST when data is given, and return the decoded JSON.
+
+        Connection errors and 502/503/504 responses are retried. A timed out
+        GET is retried with twice the timeout. A POST that timed out waiting
+        for the response raises SdTimeoutError and is not resent, since the
+        webui keeps working on it and a retry would queue a duplicate
+        generation. It does not count as a failure for the circuit breaker,
+        as the webui took the request.
+
+        :param timings: Optional list, gets (attempt, seconds) of the
+            successful attempt appended.
+        """
+        url = f"{self.base_url}{path}"
+        headers = {"Accept": "*/*", "Accept-Encoding": "deflate, gzip"}
+        body = None
+        if data is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(data).encode("utf-8")
+
+        for attempt in range(self.max_retries + 1):
+            self.breaker.before_request()
+            req = urllib.request.Request(url, data=body, headers=headers)
+            start = time.monotonic()
+            try:
+                with urllib.request.urlopen(req, timeout=timeout) as response:
+                    # Check if the response is gzipped
+                    if response.getheader("Content-Encoding") == "gzip":
+                        buf = BytesIO(response.read())
+                        response_data = gzip.GzipFile(fileobj=buf).read()
+                    else:
+                        response_data = response.read()
+            except urllib.error.HTTPError as e:
+                if e.code not in SD_TRANSIENT_HTTP_CODES:
+                    # The backend is up, the request itself was rejected
+                    self.breaker.record_success()
+                    raise SdBackendError(
+                        f"{url} returned HTTP {e.code}: {self.error_detail(e)}"
+                    ) from e
+                error = f"HTTP {e.code}"
+            except (OSError, http.client.HTTPException) as e:
+                # URLError wraps the socket error in reason
+                reason = getattr(e, "reason", e)
+                if isinstance(reason, TimeoutError):
+                    error = f"timed out after {timeout:.1f} s"
+                    # urlopen wraps errors while connecting and sending in
+                    # URLError, so a bare timeout came while waiting for the
+                    # response
+                    if body is not None and reason is e:
+                        self.breaker.record_success()
+                        raise SdTimeoutError(
+                            f"{url} {error}, the webui may still be generating."
+                        ) from e
+                    timeout = min(timeout * 2, SD_MAX_TIMEOUT)
+                else:
+                    error = str(reason) or type(reason).__name__
+            else:
+                self.breaker.record_success()
+                if timings is not None:
+                    timings.append((attempt, time.monotonic() - start))
+                try:
+                    return json.loads(response_data.decode("utf-8"))
+                except ValueError as e:
+                    raise SdBackendError(f"{url} returned invalid JSON.") from e
+
+            self.breaker.record_failure()
+            if attempt == self.max_retries or self.breaker.retry_in() > 0:
+                break
+            delay = min(self.backoff * 2**attempt, self.max_backoff)
+            delay *= random.uniform(0.5, 1.0)
+            print(f"SD request to {url} failed ({error}), retrying in {delay:.1f} s")
+            self.sleep(delay)
+
+        raise SdBackendError(f"{url} failed after {attempt + 1} attempt(s): {error}")
+
+    def error_detail(self, error):
+        try:
+            detail = json.loads(error.read().decode("utf-8"))
+        except (ValueError, OSError):
+            return error.reason
+        if isinstance(detail, dict):
+            return detail.get("detail") or detail.get("error") or error.reason
+        return error.reason
+
+    def get_loaded_checkpoint(self, max_age=SD_CHECKPOINT_MAX_AGE):
+        """
+        Checkpoint loaded by the webui, cached for max_age seconds.
+
+        :return: Checkpoint title, or None if it cannot be queried.
+        """
+        with self.lock:
+            if (
+                self.checkpoint_checked_at is not None
+                and time.monotonic() - self.checkpoint_checked_at < max_age
+            ):
+                return self.checkpoint
+        try:
+            options = self.request("/sdapi/v1/options")
+        except SdBackendError as e:
+            print(f"Unable to get the loaded checkpoint: {e}")
+            return None
+        checkpoint = options.get("sd_model_checkpoint")
+        self.set_loaded_checkpoint(checkpoint)
+        return checkpoint
+
+    def set_loaded_checkpoint(self, checkpoint):
+        with self.lock:
+            self.checkpoint = checkpoint
+            self.checkpoint_checked_at = time.monotonic()
+
+    def is_checkpoint_warm(self, checkpoint):
+        """
+        Whether the checkpoint was loaded when the webui was last seen,
+        without contacting it. None if that is older than
+        SD_CHECKPOINT_MAX_AGE, since other clients may have switched since.
+        """
+        with self.lock:
+            if (
+                self.checkpoint_checked_at is None
+                or time.monotonic() - self.checkpoint_checked_at
+                >= SD_CHECKPOINT_MAX_AGE
+            ):
+                return None
+            return checkpoint_matches(self.checkpoint, checkpoint)
+
+    def response_checkpoint(self, response_json):
+        """Checkpoint reported in the "info" of a generation response."""
+        try:
+            info = json.loads(response_json.get("info") or "{}")
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(info, dict):
+            return None
+        name = info.get("sd_model_name") or ""
+        short_hash = info.get("sd_model_hash")
+        if short_hash:
+            return f"{name} [{short_hash}]"
+        return name or None
+
+    def generate(self, path, data, checkpoint=None):
+        """
+        POST a generation request with a timeout based on the expected
+        generation time and the number of requests queued on this backend.
+
+        The loaded checkpoint is read right before the request, and the
+        override is only sent when it differs. The new checkpoint is kept
+        loaded afterwards. If another client switched checkpoints in between,
+        the response reports it and the request is sent again with the
+        override.
+        """
+        model_load = False
+        if checkpoint:
+            loaded = self.get_loaded_checkpoint(max_age=0.0)
+            model_load = not checkpoint_matches(loaded, checkpoint)
+
+        response_json = self.send_generation(path, data, checkpoint, model_load)
+        if checkpoint and not model_load:
+            used = self.response_checkpoint(response_json)
+            if used is not None and not checkpoint_matches(used, checkpoint):
+                print(f"Webui generated with {used} instead of {checkpoint}")
+                response_json = self.send_generation(path, data, checkpoint, True)
+        return response_json
+
+    def send_generation(self, path, data, checkpoint, model_load):
+        if model_load:
+            data = dict(
+                data,
+                override_settings={"sd_model_checkpoint": checkpoint},
+                override_settings_restore_afterwards=False,
+            )
+
+        steps = data.get("steps", 20)
+        width = data.get("width", 512)
+        height = data.get("height", 512)
+        with self.lock:
+            self.in_flight += 1
+            queued = self.in_flight
+        timings = []
+        timeout = self.latency.timeout(
+            steps, width, height, queued, model_load=model_load
+        )
+        try:
+            response_json = self.request(path, data, timeout=timeout, timings=timings)
+        except SdTimeoutError:
+            # Without this the estimate could only shrink, and a webui slower
+            # than the first estimate would time out on every request
+            spent = timeout - (SD_MODEL_LOAD_TIMEOUT if model_load else 0.0)
+            self.latency.record_timeout(steps, width, height, max(spent, 0.0) / queued)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                alone = queued == 1 and self.in_flight == 0
+        used = self.response_checkpoint(response_json)
+        if used is not None or model_load:
+            self.set_loaded_checkpoint(used or checkpoint)
+        # Only requests that succeeded on the first attempt without waiting
+        # behind others or for a checkpoint load measure the speed
+        if not model_load and alone and timings and timings[0][0] == 0:
+            self.latency.record(steps, width, height, timings[0][1])
+        return response_json
+
+
+# Image pixels replaced by the last projection. Writing pixels from Python
+# bypasses Blender's image undo, so "Undo Projection" restores them instead.
+_projection_undo = {}
+
+_sd_backends = {}
+_sd_backends_lock = threading.Lock()
+
+
+def get_sd_backend(ip, port):
+    """Shared SdBackend for a host, so state survives between operators."""
+    base_url = f"http://{ip}:{port}"
+    with _sd_backends_lock:
+        if base_url not in _sd_backends:
+            _sd_backends[base_url] = SdBackend(base_url)
+        return _sd_backends[base_url]
+
+
+class SdViewResult(bpy.types.PropertyGroup):
+    view_matrix: bpy.props.FloatVectorProperty(
+        name="View Matrix", description="Flattened viewport view matrix", size=16
+    )
+    view_distance: bpy.props.FloatProperty(
+        name="View Distance", description="Viewport orbit distance"
+    )
+    view_perspective: bpy.props.StringProperty(
+        name="View Perspective", description="Viewport projection type"
+    )
+    sd_model: bpy.props.StringProperty(
+        name="SD Model",
+        description="Checkpoint pinned for this view, the selected SD model is "
+        "used when empty",
+    )
+    image: bpy.props.PointerProperty(
+        name="Image", description="Image generated for this view", type=bpy.types.Image
+    )
 
 
 class SdProperties(bpy.types.PropertyGroup):
@@ -113,6 +549,52 @@ class SdProperties(bpy.types.PropertyGroup):
         update=update_brush_texture_alpha,
     )
 
+    projection_falloff_angle: bpy.props.FloatProperty(
+        name="Falloff Angle",
+        description="Faces turned away from the view by more than this angle "
+        "are not painted when projecting onto the texture",
+        subtype="ANGLE",
+        default=math.radians(75.0),
+        min=0.0,
+        max=math.radians(90.0),
+    )
+
+    views: bpy.props.CollectionProperty(type=SdViewResult)
+
+    orbit_view_count: bpy.props.IntProperty(
+        name="Orbit Views",
+        description="Number of views added around the active object",
+        default=4,
+        min=1,
+        max=32,
+    )
+
+    orbit_elevation: bpy.props.FloatProperty(
+        name="Orbit Elevation",
+        description="Elevation of the views added around the active object",
+        subtype="ANGLE",
+        default=math.radians(15.0),
+        min=math.radians(-89.0),
+        max=math.radians(89.0),
+    )
+
+    max_concurrent_requests: bpy.props.IntProperty(
+        name="Concurrent Requests",
+        description="Maximum number of views sent to SD at the same time",
+        default=4,
+        min=1,
+        max=16,
+    )
+
+    projection_occlusion_bias: bpy.props.FloatProperty(
+        name="Occlusion Bias",
+        description="Depth tolerance, as a fraction of the mesh depth range, "
+        "used to decide whether a texel is hidden behind another part of the mesh",
+        default=0.01,
+        min=0.0,
+        max=1.0,
+    )
+
 
 class SendToControlNetOperator(bpy.types.Operator):
     bl_idname = "mesh.send_to_control_net"
@@ -120,6 +602,7 @@ class SendToControlNetOperator(bpy.types.Operator):
     bl_description = "Send current view to Control Net"
 
     button_id: bpy.props.StringProperty()
+    view_index: bpy.props.IntProperty(default=-1)
 
     def crop_image_to_aspect_ratio(self, target_width, target_height, image_path):
         """
@@ -250,34 +733,448 @@ class SendToControlNetOperator(bpy.types.Operator):
         y = int((0.5 + coord_ndc.y / 2.0) * bpy.context.scene.render.resolution_y)
         return x, y
 
+    def get_view_region_3d(self, context):
+        """
+        Return the RegionView3D of the 3D View the operator was called from,
+        the same view render.opengl(view_context=True) captures.
+
+        :param context: The operator context.
+        :return: The RegionView3D, or None outside a 3D View.
+        """
+        space = context.space_data
+        if space is None or space.type != "VIEW_3D":
+            return None
+        return space.region_3d
+
+    def rasterize_triangles(self, triangles, width, height, chunk_size=1 << 20):
+        """
+        Find the pixel centres covered by 2D triangles, vectorized in chunks.
+
+        Corners are snapped to 1/256 pixel and the edge functions are exact
+        integers with a top-left fill rule, so a pixel centre on an edge shared
+        by two triangles belongs to exactly one of them. Bounding boxes are
+        split into row bands, so a chunk holds at most chunk_size pixels, or a
+        single row when that is wider. Triangles with corners more than 2**21
+        pixels away from the grid are skipped.
+
+        :param triangles: (n, 3, 2) array of triangle corners in pixel units.
+        :param width: Width of the pixel grid.
+        :param height: Height of the pixel grid.
+        :param chunk_size: Maximum number of candidate pixels per chunk.
+        :return: Generator of (triangle index, x, y, barycentric weights) arrays.
+        """
+        triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 2)
+        usable = np.isfinite(triangles).all(axis=(1, 2)) & (
+            np.abs(triangles) < 2**21
+        ).all(axis=(1, 2))
+        fixed = np.zeros(triangles.shape, dtype=np.int64)
+        fixed[usable] = np.round(triangles[usable] * 256)
+
+        # Make every triangle counter-clockwise, swapping b and c if needed
+        ax, ay = fixed[:, 0, 0], fixed[:, 0, 1]
+        bx, by = fixed[:, 1, 0], fixed[:, 1, 1]
+        cx, cy = fixed[:, 2, 0], fixed[:, 2, 1]
+        area = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+        flipped = area < 0
+        bx, cx = np.where(flipped, cx, bx), np.where(flipped, bx, cx)
+        by, cy = np.where(flipped, cy, by), np.where(flipped, by, cy)
+        area = np.abs(area)
+
+        # Edge function of the edge opposite each corner:
+        # e(x, y) = step_x * (x - x_from) + step_y * (y - y_from)
+        edges = []
+        for from_x, from_y, to_x, to_y in (
+            (bx, by, cx, cy),
+            (cx, cy, ax, ay),
+            (ax, ay, bx, by),
+        ):
+            dx = to_x - from_x
+            dy = to_y - from_y
+            # Top-left rule: pixels exactly on an edge are kept for one of
+            # the two directions it can be walked in
+            top_left = (dy < 0) | ((dy == 0) & (dx > 0))
+            edges.append((-dy, dx, from_x, from_y, np.where(top_left, 0, 1)))
+
+        # Pixel bounding box of every triangle, clamped to the grid
+        min_x = np.minimum(np.minimum(ax, bx), cx) - 128
+        max_x = np.maximum(np.maximum(ax, bx), cx) - 128
+        min_y = np.minimum(np.minimum(ay, by), cy) - 128
+        max_y = np.maximum(np.maximum(ay, by), cy) - 128
+        x0 = np.maximum(-(-min_x // 256), 0)
+        x1 = np.minimum(max_x // 256, width - 1)
+        y0 = np.maximum(-(-min_y // 256), 0)
+        y1 = np.minimum(max_y // 256, height - 1)
+        box_w = x1 - x0 + 1
+        box_h = y1 - y0 + 1
+
+        keep = np.nonzero(usable & (area > 0) & (box_w > 0) & (box_h > 0))[0]
+
+        # Split bounding boxes into bands of rows that fit in a chunk
+        band_rows = np.maximum(chunk_size // box_w[keep], 1)
+        band_count = -(-box_h[keep] // band_rows)
+        band_tri = np.repeat(keep, band_count)
+        band_index = np.arange(band_tri.size) - np.repeat(
+            np.cumsum(band_count) - band_count, band_count
+        )
+        band_rows = np.repeat(band_rows, band_count)
+        band_y = y0[band_tri] + band_index * band_rows
+        band_rows = np.minimum(band_rows, y1[band_tri] - band_y + 1)
+        counts = band_rows * box_w[band_tri]
+        ends = np.cumsum(counts)
+
+        start = 0
+        while start < band_tri.size:
+            base = ends[start] - counts[start]
+            stop = max(
+                int(np.searchsorted(ends, base + chunk_size, side="right")), start + 1
+            )
+
+            # One entry per pixel row of the bands in this chunk
+            rows = band_rows[start:stop]
+            row_band = np.repeat(np.arange(start, stop), rows)
+            row_tri = band_tri[row_band]
+            row_y = band_y[row_band] + (
+                np.arange(row_band.size) - np.repeat(np.cumsum(rows) - rows, rows)
+            )
+            row_x = x0[row_tri]
+
+            # Biased edge values at the first pixel centre of every row, and
+            # their change per pixel along the row
+            centre_x = row_x * 256 + 128
+            centre_y = row_y * 256 + 128
+            row_bias = [bias[row_tri] for *_, bias in edges]
+            values = []
+            steps = []
+            for (step_x, step_y, from_x, from_y, _), bias in zip(edges[:2], row_bias):
+                values.append(
+                    step_x[row_tri] * (centre_x - from_x[row_tri])
+                    + step_y[row_tri] * (centre_y - from_y[row_tri])
+                    - bias
+                )
+                steps.append(step_x[row_tri] * 256)
+            # The three edge values always add up to the area
+            values.append(area[row_tri] - sum(row_bias) - values[0] - values[1])
+            steps.append(-steps[0] - steps[1])
+
+            # Exact span of every row where all biased edge values are >= 0
+            first = np.zeros(row_tri.size, dtype=np.int64)
+            last = box_w[row_tri] - 1
+            for value, step in zip(values, steps):
+                safe_step = np.where(step == 0, 1, step)
+                first = np.where(
+                    step > 0, np.maximum(first, -(value // safe_step)), first
+                )
+                last = np.where(step < 0, np.minimum(last, value // -safe_step), last)
+                last = np.where((step == 0) & (value < 0), -1, last)
+            span = np.maximum(last - first + 1, 0)
+
+            pixel_row = np.repeat(np.arange(row_tri.size, dtype=np.int32), span)
+            col = (
+                np.arange(pixel_row.size, dtype=np.int64)
+                - np.repeat(np.cumsum(span) - span, span)
+                + first[pixel_row]
+            )
+
+            row_area = area[row_tri].astype(np.float64)
+            l0 = (
+                values[0][pixel_row]
+                + steps[0][pixel_row] * col
+                + row_bias[0][pixel_row]
+            ) / row_area[pixel_row]
+            l1 = (
+                values[1][pixel_row]
+                + steps[1][pixel_row] * col
+                + row_bias[1][pixel_row]
+            ) / row_area[pixel_row]
+            l2 = 1.0 - l0 - l1
+            swap = flipped[row_tri][pixel_row]
+            bary = np.stack(
+                (l0, np.where(swap, l2, l1), np.where(swap, l1, l2)), axis=1
+            ).astype(np.float32)
+
+            yield (
+                row_tri[pixel_row],
+                (row_x[pixel_row] + col).astype(np.int32),
+                row_y[pixel_row].astype(np.int32),
+                bary,
+            )
+            start = stop
+
+    def sample_bilinear(self, pixels, x, y):
+        """
+        Bilinearly sample an RGBA pixel array.
+
+        :param pixels: (height, width, 4) array of pixel values.
+        :param x: Horizontal sample positions in pixel units.
+        :param y: Vertical sample positions in pixel units.
+        :return: (n, 4) array of sampled colors.
+        """
+        height, width = pixels.shape[:2]
+        x = np.clip(x - 0.5, 0, width - 1)
+        y = np.clip(y - 0.5, 0, height - 1)
+        x0 = np.minimum(x.astype(np.int64), width - 2 if width > 1 else 0)
+        y0 = np.minimum(y.astype(np.int64), height - 2 if height > 1 else 0)
+        x1 = np.minimum(x0 + 1, width - 1)
+        y1 = np.minimum(y0 + 1, height - 1)
+        fx = (x - x0)[:, None]
+        fy = (y - y0)[:, None]
+        top = pixels[y0, x0] * (1 - fx) + pixels[y0, x1] * fx
+        bottom = pixels[y1, x0] * (1 - fx) + pixels[y1, x1] * fx
+        return top * (1 - fy) + bottom * fy
+
+    def get_paint_image(self, obj):
+        image_paint = bpy.context.tool_settings.image_paint
+        if image_paint.mode == "IMAGE":
+            return image_paint.canvas
+        material = obj.active_material
+        if material is None or len(material.texture_paint_images) == 0:
+            return None
+        slot = min(material.paint_active_slot, len(material.texture_paint_images) - 1)
+        return material.texture_paint_images[slot]
+
+    def project_to_texture(self, context):
+        """
+        Bake the current stencil image onto the active image texture.
+
+        Texels of the active mesh are projected with the same view and
+        projection matrices as project_3d_to_2d, tested against a depth buffer
+        of the mesh and blended in with a falloff on faces turned away from
+        the view.
+
+        The image is changed in place, which Ctrl+Z does not revert. The
+        previous pixels of the last projection are kept for undo_projection.
+        """
+        brush_tool = context.scene.control_net_brush_tool
+        obj = context.active_object
+        if obj is None or obj.type != "MESH":
+            self.report({"ERROR"}, "Active object is not a mesh.")
+            return {"CANCELLED"}
+
+        brush = context.tool_settings.image_paint.brush
+        if (
+            brush is None
+            or brush.texture is None
+            or getattr(brush.texture, "image", None) is None
+        ):
+            self.report({"ERROR"}, "No stencil image to project.")
+            return {"CANCELLED"}
+        source = brush.texture.image
+
+        target = self.get_paint_image(obj)
+        if target is None:
+            self.report({"ERROR"}, "Active object has no image texture to paint.")
+            return {"CANCELLED"}
+
+        rv3d = self.get_view_region_3d(context)
+        if rv3d is None:
+            self.report({"ERROR"}, "Run this from a 3D Viewport.")
+            return {"CANCELLED"}
+
+        # Read the evaluated mesh into flat arrays
+        depsgraph = context.evaluated_depsgraph_get()
+        obj_eval = obj.evaluated_get(depsgraph)
+        mesh = obj_eval.to_mesh()
+        try:
+            if mesh.uv_layers.active is None:
+                self.report({"ERROR"}, "Active object has no UV map.")
+                return {"CANCELLED"}
+            mesh.calc_loop_triangles()
+            # Blender 4.0 only fills split normals on request, 4.1+ always does
+            if hasattr(mesh, "calc_normals_split"):
+                mesh.calc_normals_split()
+            coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+            mesh.vertices.foreach_get("co", coords)
+            # Corner normals keep flat faces and sharp edges flat
+            normals = np.empty(len(mesh.loop_triangles) * 9, dtype=np.float32)
+            mesh.loop_triangles.foreach_get("split_normals", normals)
+            tri_verts = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+            mesh.loop_triangles.foreach_get("vertices", tri_verts)
+            tri_loops = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+            mesh.loop_triangles.foreach_get("loops", tri_loops)
+            uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+            mesh.uv_layers.active.data.foreach_get("uv", uvs)
+        finally:
+            obj_eval.to_mesh_clear()
+        tri_verts = tri_verts.reshape(-1, 3)
+        tri_loops = tri_loops.reshape(-1, 3)
+
+        # Object space to view space
+        model_view = np.array(rv3d.view_matrix @ obj.matrix_world, dtype=np.float64)
+        view_coords = coords.reshape(-1, 3) @ model_view[:3, :3].T + model_view[:3, 3]
+        normal_matrix = np.linalg.inv(model_view[:3, :3]).T
+        view_normals = normals.reshape(-1, 3) @ normal_matrix.T
+        view_normals /= np.maximum(
+            np.linalg.norm(view_normals, axis=1, keepdims=True), 1e-12
+        )
+        view_normals = view_normals.reshape(-1, 3, 3)
+        window_matrix = np.array(rv3d.window_matrix, dtype=np.float64)
+        is_perspective = rv3d.is_perspective
+
+        # The capture is cropped to the generated image aspect ratio by
+        # ControlNet "Crop and Resize", so scale NDC to match that crop
+        src_width, src_height = source.size
+        capture_aspect = (
+            context.scene.render.resolution_x / context.scene.render.resolution_y
+        )
+        source_aspect = src_width / src_height
+        scale_x = max(capture_aspect / source_aspect, 1.0)
+        scale_y = max(source_aspect / capture_aspect, 1.0)
+
+        def view_to_source(points):
+            clip = points @ window_matrix[:, :3].T + window_matrix[:, 3]
+            w = clip[:, 3]
+            safe_w = np.where(w > 0.0, w, 1.0)
+            x = (0.5 + clip[:, 0] / safe_w * 0.5 * scale_x) * src_width
+            y = (0.5 + clip[:, 1] / safe_w * 0.5 * scale_y) * src_height
+            return x, y, w > 0.0
+
+        def facing(points, point_normals):
+            if is_perspective:
+                to_eye = -points / np.maximum(
+                    np.linalg.norm(points, axis=1, keepdims=True), 1e-12
+                )
+                return (point_normals * to_eye).sum(axis=1)
+            return point_normals[:, 2]
+
+        cos_limit = math.cos(brush_tool.projection_falloff_angle)
+
+        def facing_weight(cos_angle):
+            return np.clip((cos_angle - cos_limit) / max(1.0 - cos_limit, 1e-6), 0, 1)
+
+        vert_x, vert_y, vert_visible = view_to_source(view_coords)
+        vert_depth = -view_coords[:, 2]
+        tri_in_front = vert_visible[tri_verts].all(axis=1)
+
+        # Orthographic depths can be negative, so the bias is absolute and
+        # scaled by the depth range of the mesh
+        if vert_visible.any():
+            depth_range = np.ptp(vert_depth[vert_visible])
+        else:
+            depth_range = 0.0
+        depth_tolerance = brush_tool.projection_occlusion_bias * max(depth_range, 1e-6)
+
+        # Depth buffer of the mesh at the generated image resolution. Depth is
+        # interpolated as 1/z in screen space for perspective views.
+        screen_triangles = np.stack((vert_x, vert_y), axis=-1)[tri_verts[tri_in_front]]
+        if is_perspective:
+            tri_depth_terms = 1.0 / vert_depth[tri_verts[tri_in_front]]
+        else:
+            tri_depth_terms = vert_depth[tri_verts[tri_in_front]]
+        depth_buffer = np.full(src_width * src_height, np.inf)
+        for tri, px, py, bary in self.rasterize_triangles(
+            screen_triangles, src_width, src_height
+        ):
+            depth = (bary * tri_depth_terms[tri]).sum(axis=1)
+            if is_perspective:
+                depth = 1.0 / depth
+            np.minimum.at(depth_buffer, py * src_width + px, depth)
+
+        # Skip triangles that are behind the view or face away on every corner
+        corner_weight = facing_weight(
+            facing(view_coords[tri_verts].reshape(-1, 3), view_normals.reshape(-1, 3))
+        ).reshape(-1, 3)
+        tri_candidates = np.nonzero(tri_in_front & (corner_weight > 0.0).any(axis=1))[0]
+
+        source_pixels = np.empty(src_width * src_height * 4, dtype=np.float32)
+        source.pixels.foreach_get(source_pixels)
+        source_pixels = source_pixels.reshape(src_height, src_width, 4)
+
+        tex_width, tex_height = target.size
+        target_pixels = np.empty(tex_width * tex_height * 4, dtype=np.float32)
+        target.pixels.foreach_get(target_pixels)
+        original_pixels = target_pixels.copy()
+        target_pixels = target_pixels.reshape(-1, 4)
+
+        uv_triangles = uvs.reshape(-1, 2)[tri_loops[tri_candidates]] * (
+            tex_width,
+            tex_height,
+        )
+        painted = 0
+        for tri, px, py, bary in self.rasterize_triangles(
+            uv_triangles, tex_width, tex_height
+        ):
+            corners = tri_verts[tri_candidates[tri]]
+            points = np.einsum("nk,nkj->nj", bary, view_coords[corners])
+            point_normals = np.einsum(
+                "nk,nkj->nj", bary, view_normals[tri_candidates[tri]]
+            )
+            point_normals /= np.maximum(
+                np.linalg.norm(point_normals, axis=1, keepdims=True), 1e-12
+            )
+
+            x, y, in_front = view_to_source(points)
+            weight = facing_weight(facing(points, point_normals))
+            valid = (
+                in_front
+                & (weight > 0.0)
+                & (x >= 0)
+                & (x < src_width)
+                & (y >= 0)
+                & (y < src_height)
+            )
+
+            # Occlusion test against the depth buffer
+            buffer_index = np.clip(y.astype(np.int64), 0, src_height - 1) * src_width
+            buffer_index += np.clip(x.astype(np.int64), 0, src_width - 1)
+            valid &= -points[:, 2] <= depth_buffer[buffer_index] + depth_tolerance
+            if not valid.any():
+                continue
+
+            color = self.sample_bilinear(source_pixels, x[valid], y[valid])
+            alpha = (color[:, 3] * weight[valid])[:, None]
+            texel_index = py[valid] * tex_width + px[valid]
+            texels = target_pixels[texel_index]
+            texels[:, :3] = texels[:, :3] * (1.0 - alpha) + color[:, :3] * alpha
+            texels[:, 3:] = alpha + texels[:, 3:] * (1.0 - alpha)
+            target_pixels[texel_index] = texels
+            painted += texel_index.size
+
+        _projection_undo.clear()
+        _projection_undo["image"] = target.name
+        _projection_undo["pixels"] = original_pixels
+        target.pixels.foreach_set(target_pixels.ravel())
+        target.update()
+        context.area.tag_redraw()
+
+        self.report({"INFO"}, f"Projected stencil onto {painted} texels.")
+        return {"FINISHED"}
+
+    def undo_projection(self, context):
+        image = bpy.data.images.get(_projection_undo.get("image", ""))
+        pixels = _projection_undo.get("pixels")
+        if image is None or pixels is None or pixels.size != len(image.pixels):
+            self.report({"ERROR"}, "No projection to undo.")
+            return {"CANCELLED"}
+        image.pixels.foreach_set(pixels)
+        image.update()
+        _projection_undo.clear()
+        context.area.tag_redraw()
+        self.report({"INFO"}, f"Restored {image.name}.")
+        return {"FINISHED"}
+
     def annotate_to_points(self):
         # Step 2: Get the 3D Viewport region and RegionView3D for projection
         points_2d = []  # Store 2D points to draw red dots later
 
-        for area in bpy.context.window.screen.areas:
-            if area.type == "VIEW_3D":
-                region = None
-                for region_ in area.regions:
-                    if region_.type == "WINDOW":
-                        region = region_
-                        break
-
-                rv3d = area.spaces.active.region_3d
-
-                # Step 3: Project 3D Grease Pencil points into 2D coordinates
-                for gpencil in bpy.data.grease_pencils:
-                    for layer in gpencil.layers:
-                        for frame in layer.frames:
-                            for stroke in frame.strokes:
-                                for point in stroke.points:
-                                    # Get the 3D coordinate of the point
-                                    point_3d = point.co
-
-                                    # Project the 3D point to 2D viewport coordinates
-                                    point_2d = self.project_3d_to_2d(rv3d, point_3d)
-
-                                    if point_2d is not None:
-                                        points_2d.append(point_2d)
+        # Only the captured view, so the mask lines up with the capture
+        rv3d = self.get_view_region_3d(bpy.context)
+        if rv3d is None:
+            return points_2d
+
+        # Step 3: Project 3D Grease Pencil points into 2D coordinates
+        for gpencil in bpy.data.grease_pencils:
+            for layer in gpencil.layers:
+                for frame in layer.frames:
+                    for stroke in frame.strokes:
+                        for point in stroke.points:
+                            # Get the 3D coordinate of the point
+                            point_3d = point.co
+
+                            # Project the 3D point to 2D viewport coordinates
+                            point_2d = self.project_3d_to_2d(rv3d, point_3d)
+
+                            if point_2d is not None:
+                                points_2d.append(point_2d)
         return points_2d
 
     def create_brush(self, image_path, brush_tool):
@@ -287,7 +1184,9 @@ class SendToControlNetOperator(bpy.types.Operator):
 
         # Load the image
         image = bpy.data.images.load(image_path)
+        self.create_brush_from_image(image, brush_tool)
 
+    def create_brush_from_image(self, image, brush_tool):
         # Create a new texture and assign the image to it
         texture = bpy.data.textures.new(name="BrushTexture", type="IMAGE")
         texture.image = image
@@ -304,11 +1203,11 @@ class SendToControlNetOperator(bpy.types.Operator):
         # Set the new brush as the active brush in Texture Paint mode
         bpy.context.tool_settings.image_paint.brush = new_brush
 
-        v3d_list = [area for area in bpy.context.screen.areas if area.type == "VIEW_3D"]
-        if v3d_list:
-            main_v3d = max(v3d_list, key=lambda area: area.width * area.height)
-            x = main_v3d.width / 2
-            y = main_v3d.height / 2
+        # Centre the stencil in the 3D View it was captured from
+        area = bpy.context.area
+        if area is not None and area.type == "VIEW_3D":
+            x = area.width / 2
+            y = area.height / 2
             bpy.data.brushes[new_brush.name].stencil_pos.xy = x, y
 
         # Change the opacity in the viewport
@@ -319,16 +1218,31 @@ class SendToControlNetOperator(bpy.types.Operator):
         print("New stencil brush created and set as active.")
 
     def send_request_to_sd(self, brush_tool, image_path, mask_path=None):
+        path, data = self.build_sd_request(brush_tool, image_path, mask_path)
+        backend = get_sd_backend(brush_tool.sd_api_ip, brush_tool.sd_api_port)
+        return self.post_sd_request(
+            backend,
+            path,
+            data,
+            os.path.join(bpy.app.tempdir, "sd_image"),
+            brush_tool.sd_model,
+        )
+
+    def build_sd_request(self, brush_tool, image_path, mask_path=None):
+        """
+        Build the SD API path and payload for the current button.
 
+        Reads the Blender properties, so it has to run on the main thread.
+        """
         inpainting = False
 
         if "txt2img" in self.button_id:
             img2img = False
-            url = f"http://{brush_tool.sd_api_ip}:{brush_tool.sd_api_port}/sdapi/v1/txt2img"
+            path = "/sdapi/v1/txt2img"
         elif "img2img" in self.button_id or "inpainting" in self.button_id:
             img2img = True
             inpainting = "inpainting" in self.button_id
-            url = f"http://{brush_tool.sd_api_ip}:{brush_tool.sd_api_port}/sdapi/v1/img2img"
+            path = "/sdapi/v1/img2img"
 
         if inpainting and mask_path is not None:
             self.crop_image_to_aspect_ratio(
@@ -338,13 +1252,6 @@ class SendToControlNetOperator(bpy.types.Operator):
                 brush_tool.image_width, brush_tool.image_height, mask_path
             )
 
-        # Define the headers
-        headers = {
-            "Accept": "*/*",
-            "Accept-Encoding": "deflate, gzip",
-            "Content-Type": "application/json",
-        }
-
         with open(image_path, "rb") as img_file:
             base64_image = base64.b64encode(img_file.read()).decode("utf-8")
 
@@ -370,7 +1277,6 @@ class SendToControlNetOperator(bpy.types.Operator):
             "hr_scale": 1.0,
             "denoising_strength": brush_tool.denoising_strength,
             "hr_second_pass_steps": 15,
-            "override_settings": {"sd_model_checkpoint": brush_tool.sd_model},
             "alwayson_scripts": {
                 "controlnet": {
                     "args": [
@@ -428,85 +1334,72 @@ class SendToControlNetOperator(bpy.types.Operator):
                     ]
                 }
 
-        # Convert the data to JSON
-        data_json = json.dumps(data).encode("utf-8")
+        return path, data
 
-        # Create the request
-        req = urllib.request.Request(url, data=data_json, headers=headers)
+    def post_sd_request(self, backend, path, data, output_prefix, checkpoint=None):
+        """
+        Send a request built by build_sd_request and save the returned images.
 
-        ret = []
+        Does not touch Blender data, so it can run in a worker thread.
 
-        with urllib.request.urlopen(req, timeout=None) as response:
-            # Check if the response is gzipped
-            if response.getheader("Content-Encoding") == "gzip":
-                # Read and decompress the response
-                buf = BytesIO(response.read())
-                decompressed_data = gzip.GzipFile(fileobj=buf).read()
-            else:
-                # If not gzipped, read the response directly
-                decompressed_data = response.read()
-
-            # Decode the decompressed data and print it
-            response_text = decompressed_data.decode("utf-8")
-            response_json = json.loads(response_text)
-
-            for idx, img_data in enumerate(response_json["images"]):
-                # Decode the base64 image data
-                img_bytes = base64.b64decode(img_data)
-                file_path = os.path.join(bpy.app.tempdir, f"sd_image_{idx + 1}.png")
-                # Save the image to a PNG file
-                with open(file_path, "wb") as img_file:
-                    img_file.write(img_bytes)
-                ret.append(file_path)
+        :param backend: SdBackend to send the request to.
+        :param path: SD API endpoint path.
+        :param data: JSON payload.
+        :param output_prefix: Path prefix of the saved PNG files.
+        :param checkpoint: SD checkpoint title the images should be made with.
+        :return: List of saved image paths.
+        """
+        response_json = backend.generate(path, data, checkpoint)
+
+        ret = []
+        for idx, img_data in enumerate(response_json.get("images", [])):
+            # Decode the base64 image data
+            img_bytes = base64.b64decode(img_data)
+            file_path = f"{output_prefix}_{idx + 1}.png"
+            # Save the image to a PNG file
+            with open(file_path, "wb") as img_file:
+                img_file.write(img_bytes)
+            ret.append(file_path)
 
         return ret
 
     def get_sd_models(self, context):
         brush_tool = context.scene.control_net_brush_tool
-        models_url = (
-            f"http://{brush_tool.sd_api_ip}:{brush_tool.sd_api_port}/sdapi/v1/sd-models"
-        )
-        control_net_models = f"http://{brush_tool.sd_api_ip}:{brush_tool.sd_api_port}/controlnet/model_list"
+        backend = get_sd_backend(brush_tool.sd_api_ip, brush_tool.sd_api_port)
 
         try:
-            req = urllib.request.Request(models_url)
-            with urllib.request.urlopen(req) as response:
-                data = response.read()
-                sd_models = json.loads(data)
-                brush_tool.available_sd_models = json.dumps(
-                    [
-                        (models["title"], models["model_name"], "")
-                        for models in sd_models
-                    ]
-                )
-            req = urllib.request.Request(control_net_models)
-            with urllib.request.urlopen(req) as response:
-                data = response.read()
-                control_net_models = json.loads(data)
-                brush_tool.available_controlnet_models = json.dumps(
-                    control_net_models["model_list"]
-                )
-        except urllib.error.URLError as e:
+            sd_models = backend.request("/sdapi/v1/sd-models")
+            brush_tool.available_sd_models = json.dumps(
+                [(models["title"], models["model_name"], "") for models in sd_models]
+            )
+            control_net_models = backend.request("/controlnet/model_list")
+            brush_tool.available_controlnet_models = json.dumps(
+                control_net_models["model_list"]
+            )
+            backend.get_loaded_checkpoint(max_age=0.0)
+        except SdBackendError as e:
             self.report({"ERROR"}, str(e))
             return {"CANCELLED"}
 
         return {"FINISHED"}
 
-    def get_viewport_capture(self):
-        output_path = os.path.join(bpy.app.tempdir, "viewport_capture.png")
-
-        for area in bpy.context.screen.areas:
-            if area.type == "VIEW_3D":
-                for space in area.spaces:
-                    if space.type == "VIEW_3D":
-                        previous_overlays_state = space.overlay.show_overlays
-                        previous_annotation_state = space.overlay.show_annotation
-                        space.overlay.show_overlays = False
-                        space.overlay.show_annotation = False
-                        # Capture the viewport using OpenGL without saving to a file
-                        bpy.ops.render.opengl(write_still=False, view_context=True)
-                        space.overlay.show_overlays = previous_overlays_state
-                        space.overlay.show_annotation = previous_annotation_state
+    def get_viewport_capture(self, context, file_name="viewport_capture.png"):
+        output_path = os.path.join(bpy.app.tempdir, file_name)
+
+        # view_context renders the calling 3D View, so only that one is set up
+        space = context.space_data
+        if space is None or space.type != "VIEW_3D":
+            return None
+        previous_overlays_state = space.overlay.show_overlays
+        previous_annotation_state = space.overlay.show_annotation
+        space.overlay.show_overlays = False
+        space.overlay.show_annotation = False
+        try:
+            # Capture the viewport using OpenGL without saving to a file
+            bpy.ops.render.opengl(write_still=False, view_context=True)
+        finally:
+            space.overlay.show_overlays = previous_overlays_state
+            space.overlay.show_annotation = previous_annotation_state
 
         # Access the 'Render Result' image
         render_result = bpy.data.images.get("Render Result")
@@ -629,7 +1522,7 @@ class SendToControlNetOperator(bpy.types.Operator):
     def create_brush_from_scene(self, context):
         brush_tool = context.scene.control_net_brush_tool
 
-        viewport_image_path = self.get_viewport_capture()
+        viewport_image_path = self.get_viewport_capture(context)
 
         # Check if the image exists
         if viewport_image_path is not None:
@@ -642,9 +1535,17 @@ class SendToControlNetOperator(bpy.types.Operator):
                     self.report({"ERROR"}, "Failed to get Annotation.")
                     return {"FINISHED"}
 
-            images = self.send_request_to_sd(
-                brush_tool, viewport_image_path, mask_image_path
-            )
+            try:
+                images = self.send_request_to_sd(
+                    brush_tool, viewport_image_path, mask_image_path
+                )
+            except SdBackendError as e:
+                if brush_tool.remove_tmp_files:
+                    os.remove(viewport_image_path)
+                    if mask_image_path is not None:
+                        os.remove(mask_image_path)
+                self.report({"ERROR"}, str(e))
+                return {"CANCELLED"}
 
             if len(images) > 0:
                 if context.scene.control_net_brush_tool.remove_tmp_files:
@@ -668,11 +1569,257 @@ class SendToControlNetOperator(bpy.types.Operator):
             self.report({"ERROR"}, "Failed to capture viewport.")
         return {"FINISHED"}
 
+    def store_view(self, brush_tool, view_matrix, view_distance, view_perspective):
+        view = brush_tool.views.add()
+        view.name = f"View {len(brush_tool.views)}"
+        view.view_matrix = [value for row in view_matrix for value in row]
+        view.view_distance = view_distance
+        # Camera views are stored as free perspective views of the same matrix
+        view.view_perspective = "ORTHO" if view_perspective == "ORTHO" else "PERSP"
+        return view
+
+    def apply_view(self, rv3d, view):
+        values = list(view.view_matrix)
+        rv3d.view_perspective = view.view_perspective
+        rv3d.view_distance = view.view_distance
+        rv3d.view_matrix = mathutils.Matrix(
+            [values[row * 4 : row * 4 + 4] for row in range(4)]
+        )
+        # Redraw so the capture and projection see the new view
+        bpy.ops.wm.redraw_timer(type="DRAW_WIN_SWAP", iterations=1)
+
+    def add_view(self, context):
+        brush_tool = context.scene.control_net_brush_tool
+        rv3d = self.get_view_region_3d(context)
+        if rv3d is None:
+            self.report({"ERROR"}, "Run this from a 3D Viewport.")
+            return {"CANCELLED"}
+        self.store_view(
+            brush_tool, rv3d.view_matrix, rv3d.view_distance, rv3d.view_perspective
+        )
+        return {"FINISHED"}
+
+    def add_orbit_views(self, context):
+        """
+        Add views evenly spaced around the active object, at the current
+        viewport distance.
+        """
+        brush_tool = context.scene.control_net_brush_tool
+        rv3d = self.get_view_region_3d(context)
+        obj = context.active_object
+        if rv3d is None or obj is None:
+            self.report({"ERROR"}, "Orbit views need an active object and a 3D View.")
+            return {"CANCELLED"}
+
+        corners = [
+            obj.matrix_world @ mathutils.Vector(corner) for corner in obj.bound_box
+        ]
+        center = sum(corners, mathutils.Vector()) / len(corners)
+        distance = rv3d.view_distance
+        count = brush_tool.orbit_view_count
+
+        for i in range(count):
+            azimuth = 2.0 * math.pi * i / count
+            rotation = mathutils.Euler(
+                (math.pi / 2.0 - brush_tool.orbit_elevation, 0.0, azimuth)
+            ).to_matrix()
+            view_to_world = (
+                mathutils.Matrix.Translation(center)
+                @ rotation.to_4x4()
+                @ mathutils.Matrix.Translation((0.0, 0.0, distance))
+            )
+            self.store_view(
+                brush_tool,
+                view_to_world.inverted(),
+                distance,
+                rv3d.view_perspective,
+            )
+        return {"FINISHED"}
+
+    def clear_views(self, context):
+        brush_tool = context.scene.control_net_brush_tool
+        for view in brush_tool.views:
+            if view.image is not None:
+                bpy.data.images.remove(view.image)
+        brush_tool.views.clear()
+        return {"FINISHED"}
+
+    def generate_views(self, context):
+        """
+        Capture every stored view, then send all of them to SD as one
+        concurrent job set and keep each result with its view.
+        """
+        brush_tool = context.scene.control_net_brush_tool
+        rv3d = self.get_view_region_3d(context)
+        if rv3d is None:
+            self.report({"ERROR"}, "Run this from a 3D Viewport.")
+            return {"CANCELLED"}
+        if len(brush_tool.views) == 0:
+            self.report({"ERROR"}, "No views to generate.")
+            return {"CANCELLED"}
+
+        # Capturing needs the viewport, so it runs on the main thread first
+        original_view = (
+            rv3d.view_perspective,
+            rv3d.view_distance,
+            rv3d.view_matrix.copy(),
+        )
+        captures = []
+        jobs = []
+        results = {}
+        generated = 0
+        try:
+            try:
+                for index, view in enumerate(brush_tool.views):
+                    self.apply_view(rv3d, view)
+                    capture_path = self.get_viewport_capture(
+                        context, f"viewport_capture_view_{index + 1}.png"
+                    )
+                    if capture_path is None:
+                        self.report({"ERROR"}, f"Failed to capture {view.name}.")
+                        continue
+                    captures.append(capture_path)
+                    path, data = self.build_sd_request(brush_tool, capture_path)
+                    checkpoint = view.sd_model or brush_tool.sd_model
+                    jobs.append((index, path, data, checkpoint))
+            finally:
+                rv3d.view_perspective = original_view[0]
+                rv3d.view_distance = original_view[1]
+                rv3d.view_matrix = original_view[2]
+
+            backend = get_sd_backend(brush_tool.sd_api_ip, brush_tool.sd_api_port)
+            results, errors = self.post_view_requests(
+                backend, jobs, brush_tool.max_concurrent_requests
+            )
+            for index, error in errors:
+                self.report({"ERROR"}, f"View {index + 1}: {error}")
+
+            for index, path, data, checkpoint in jobs:
+                images = results.get(index, [])
+                if len(images) == 0:
+                    continue
+                view = brush_tool.views[index]
+                try:
+                    image = bpy.data.images.load(images[0])
+                except RuntimeError as e:
+                    self.report({"ERROR"}, f"View {index + 1}: {e}")
+                    continue
+                if view.image is not None:
+                    bpy.data.images.remove(view.image)
+                image.name = view.name
+                # Pack the result so it survives removal of the temp files
+                image.pack()
+                view.image = image
+                generated += 1
+        finally:
+            if brush_tool.remove_tmp_files:
+                tmp_files = list(captures)
+                for images in results.values():
+                    tmp_files.extend(images)
+                for tmp_file in tmp_files:
+                    if os.path.isfile(tmp_file):
+                        os.remove(tmp_file)
+
+        if generated == 0:
+            self.report({"ERROR"}, "Failed to get images from sd.")
+            return {"FINISHED"}
+        self.report(
+            {"INFO"}, f"Generated {generated} of {len(brush_tool.views)} views."
+        )
+        return {"FINISHED"}
+
+    def post_view_requests(self, backend, jobs, max_workers):
+        """
+        Send the requests of captured views concurrently. Views sharing a
+        checkpoint run together, one group after another, so each checkpoint
+        is loaded at most once.
+
+        Does not touch Blender data, so the results of finished views are
+        kept when others fail.
+
+        :param backend: SdBackend to send the requests to.
+        :param jobs: List of (view index, path, data, checkpoint).
+        :param max_workers: Maximum number of requests in flight.
+        :return: Dict of view index to saved image paths, and a list of
+            (view index, exception) for the views that failed.
+        """
+        results = {}
+        errors = []
+        groups = group_by_checkpoint(
+            [(job[3], job) for job in jobs], backend.get_loaded_checkpoint()
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for _, group in groups:
+                futures = {
+                    executor.submit(
+                        self.post_sd_request,
+                        backend,
+                        path,
+                        data,
+                        os.path.join(bpy.app.tempdir, f"sd_view_{index + 1}"),
+                        checkpoint,
+                    ): index
+                    for index, path, data, checkpoint in group
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    index = futures[future]
+                    # A failed view must not discard the ones that finished
+                    try:
+                        results[index] = future.result()
+                    except Exception as e:
+                        errors.append((index, e))
+        return results, errors
+
+    def pin_view_model(self, context):
+        """
+        Pin the selected SD model to a view, or unpin it so the view follows
+        the selected model again.
+        """
+        brush_tool = context.scene.control_net_brush_tool
+        if not 0 <= self.view_index < len(brush_tool.views):
+            self.report({"ERROR"}, "View not found.")
+            return {"CANCELLED"}
+        view = brush_tool.views[self.view_index]
+        view.sd_model = "" if view.sd_model else brush_tool.sd_model
+        return {"FINISHED"}
+
+    def recall_view(self, context):
+        brush_tool = context.scene.control_net_brush_tool
+        rv3d = self.get_view_region_3d(context)
+        if rv3d is None or not 0 <= self.view_index < len(brush_tool.views):
+            self.report({"ERROR"}, "View not found.")
+            return {"CANCELLED"}
+
+        view = brush_tool.views[self.view_index]
+        self.apply_view(rv3d, view)
+        if view.image is None:
+            self.report({"WARNING"}, f"{view.name} has no generated image yet.")
+            return {"FINISHED"}
+        self.create_brush_from_image(view.image, brush_tool)
+        self.set_texture_painting_mode()
+        return {"FINISHED"}
+
     def execute(self, context):
         if "create_brush" in self.button_id:
             return self.create_brush_from_scene(context)
         elif self.button_id == "get_models":
             return self.get_sd_models(context)
+        elif self.button_id == "project_to_texture":
+            return self.project_to_texture(context)
+        elif self.button_id == "undo_projection":
+            return self.undo_projection(context)
+        elif self.button_id == "add_view":
+            return self.add_view(context)
+        elif self.button_id == "add_orbit_views":
+            return self.add_orbit_views(context)
+        elif self.button_id == "clear_views":
+            return self.clear_views(context)
+        elif "generate_views" in self.button_id:
+            return self.generate_views(context)
+        elif self.button_id == "recall_view":
+            return self.recall_view(context)
+        elif self.button_id == "pin_view_model":
+            return self.pin_view_model(context)
 
 
 class SendToControlNetPanel(bpy.types.Panel):
@@ -693,7 +1840,18 @@ class SendToControlNetPanel(bpy.types.Panel):
         col.prop(brush_tool, "sd_api_port")
         op = col.operator("mesh.send_to_control_net", text="Get models")
         op.button_id = "get_models"
+        backend = get_sd_backend(brush_tool.sd_api_ip, brush_tool.sd_api_port)
+        retry_in = backend.breaker.retry_in()
+        if retry_in > 0:
+            col.label(text=f"SD unavailable, retry in {retry_in:.0f} s", icon="ERROR")
         col.prop(brush_tool, "sd_model")
+        warm = backend.is_checkpoint_warm(brush_tool.sd_model)
+        if warm is None:
+            col.label(text="Model state unknown", icon="QUESTION")
+        elif warm:
+            col.label(text="Model warm", icon="CHECKMARK")
+        else:
+            col.label(text="Model cold, first request loads it", icon="FREEZE")
         col.prop(brush_tool, "controlnet_model")
         col.prop(brush_tool, "depth_preprocessor")
         col.prop(brush_tool, "sd_prompt")
@@ -708,10 +1866,51 @@ class SendToControlNetPanel(bpy.types.Panel):
         op = col.operator("mesh.send_to_control_net", text="Brush from Inpainting")
         op.button_id = "create_brush_inpainting"
         col.prop(brush_tool, "overlay_alpha")
+        col.prop(brush_tool, "projection_falloff_angle")
+        col.prop(brush_tool, "projection_occlusion_bias")
+        op = col.operator("mesh.send_to_control_net", text="Project onto Texture")
+        op.button_id = "project_to_texture"
+        op = col.operator("mesh.send_to_control_net", text="Undo Projection")
+        op.button_id = "undo_projection"
+
+        col = layout.column(align=True)
+        col.label(text="Multiple views:")
+        op = col.operator("mesh.send_to_control_net", text="Add View")
+        op.button_id = "add_view"
+        col.prop(brush_tool, "orbit_view_count")
+        col.prop(brush_tool, "orbit_elevation")
+        op = col.operator("mesh.send_to_control_net", text="Add Orbit Views")
+        op.button_id = "add_orbit_views"
+        col.prop(brush_tool, "max_concurrent_requests")
+        op = col.operator("mesh.send_to_control_net", text="Views from txt2img")
+        op.button_id = "generate_views_txt2img"
+        op = col.operator("mesh.send_to_control_net", text="Views from img2img")
+        op.button_id = "generate_views_img2img"
+        for index, view in enumerate(brush_tool.views):
+            row = col.row(align=True)
+            row.label(
+                text=view.name,
+                icon="IMAGE_DATA" if view.image is not None else "DOT",
+            )
+            model = view.sd_model or brush_tool.sd_model
+            row.label(text=checkpoint_key(model)[0] if model else "No model")
+            op = row.operator(
+                "mesh.send_to_control_net",
+                text="",
+                icon="PINNED" if view.sd_model else "UNPINNED",
+            )
+            op.button_id = "pin_view_model"
+            op.view_index = index
+            op = row.operator("mesh.send_to_control_net", text="Recall")
+            op.button_id = "recall_view"
+            op.view_index = index
+        op = col.operator("mesh.send_to_control_net", text="Clear Views")
+        op.button_id = "clear_views"
 
 
 # Register the classes
 def register():
+    bpy.utils.register_class(SdViewResult)
     bpy.utils.register_class(SdProperties)
     bpy.types.Scene.control_net_brush_tool = bpy.props.PointerProperty(
         type=SdProperties
@@ -725,6 +1924,7 @@ def unregister():
     bpy.utils.unregister_class(SendToControlNetPanel)
     del bpy.types.Scene.control_net_brush_tool
     bpy.utils.unregister_class(SdProperties)
+    bpy.utils.unregister_class(SdViewResult)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+"""
+Minimal stand-ins for the Blender modules, so the parts of the add-on that
+do not need Blender can be imported and tested with plain Python.
+"""
+
+import os
+import sys
+import tempfile
+import types
+
+
+class _Anything:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return _Anything()
+
+    def __getattr__(self, name):
+        return _Anything()
+
+
+def install():
+    if "bpy" in sys.modules:
+        return
+    bpy = types.ModuleType("bpy")
+    bpy.types = types.SimpleNamespace(
+        PropertyGroup=object, Operator=object, Panel=object, Image=object
+    )
+    bpy.props = _Anything()
+    bpy.utils = _Anything()
+    bpy.app = types.SimpleNamespace(tempdir=tempfile.gettempdir())
+    sys.modules["bpy"] = bpy
+    sys.modules["mathutils"] = types.ModuleType("mathutils")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+install()
@@ -0,0 +1,131 @@
+import tracemalloc
+import unittest
+
+import numpy as np
+
+import bpy_shim  # noqa: F401  installs the fake bpy before the add-on import
+import stencil_from_control_net as addon
+
+
+def quad_grid(size, cells, clockwise=True, offset=0.0):
+    """
+    Triangles of a cells x cells quad grid covering a size x size image,
+    with the second triangle of every quad wound clockwise or not.
+    """
+    grid = np.linspace(0, size, cells + 1)
+    x, y = np.meshgrid(grid, grid)
+    points = np.stack((x, y), axis=-1) + offset
+    a = points[:-1, :-1].reshape(-1, 2)
+    b = points[:-1, 1:].reshape(-1, 2)
+    c = points[1:, 1:].reshape(-1, 2)
+    d = points[1:, :-1].reshape(-1, 2)
+    second = np.stack((a, d, c) if clockwise else (a, c, d), axis=1)
+    return np.concatenate((np.stack((a, b, c), axis=1), second))
+
+
+class RasterizeTrianglesTest(unittest.TestCase):
+    def setUp(self):
+        self.operator = addon.SendToControlNetOperator()
+
+    def coverage(self, triangles, width, height, **kwargs):
+        counts = np.zeros(width * height, dtype=np.int64)
+        for tri, px, py, bary in self.operator.rasterize_triangles(
+            triangles, width, height, **kwargs
+        ):
+            np.add.at(counts, py.astype(np.int64) * width + px, 1)
+        return counts
+
+    def test_adjacent_triangles_cover_every_pixel_once(self):
+        for clockwise in (True, False):
+            counts = self.coverage(quad_grid(64, 8, clockwise), 64, 64)
+            self.assertEqual(counts.min(), 1)
+            self.assertEqual(counts.max(), 1)
+
+    def test_shared_edges_through_pixel_centres(self):
+        # Every edge and vertex of the shifted grid lies on pixel centres
+        counts = self.coverage(quad_grid(64, 64, offset=0.5), 65, 65)
+        counts = counts.reshape(65, 65)
+        self.assertEqual(counts.max(), 1)
+        # Centres strictly inside the grid are covered exactly once
+        self.assertEqual(counts[1:-1, 1:-1].min(), 1)
+
+    def test_barycentric_weights_reproduce_pixel_centres(self):
+        rng = np.random.default_rng(1)
+        triangles = rng.uniform(-10, 74, size=(50, 3, 2))
+        for tri, px, py, bary in self.operator.rasterize_triangles(triangles, 64, 64):
+            self.assertTrue(np.all(bary >= -1e-6))
+            np.testing.assert_allclose(bary.sum(axis=1), 1.0, atol=1e-5)
+            points = np.einsum("nk,nkj->nj", bary, triangles[tri])
+            # Corners are snapped to 1/256 pixel
+            np.testing.assert_allclose(
+                points, np.stack((px + 0.5, py + 0.5), axis=1), atol=0.01
+            )
+
+    def test_chunks_are_bounded(self):
+        triangles = quad_grid(256, 1)
+        total = 0
+        for tri, px, py, bary in self.operator.rasterize_triangles(
+            triangles, 256, 256, chunk_size=1000
+        ):
+            self.assertLessEqual(tri.size, 1000)
+            total += tri.size
+        self.assertEqual(total, 256 * 256)
+
+    def test_memory_does_not_grow_with_triangle_size(self):
+        tracemalloc.start()
+        for chunk in self.operator.rasterize_triangles(
+            quad_grid(2048, 1), 2048, 2048, chunk_size=1 << 16
+        ):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # 4M pixels, but only 64K per chunk at a few dozen bytes each
+        self.assertLess(peak, 32 * 1024 * 1024)
+
+    def test_skips_degenerate_and_offscreen_triangles(self):
+        triangles = np.array(
+            [
+                [[0, 0], [10, 10], [20, 20]],
+                [[-50, -50], [-40, -50], [-40, -40]],
+                [[0, 0], [np.nan, 0], [0, 5]],
+            ]
+        )
+        self.assertEqual(self.coverage(triangles, 32, 32).sum(), 0)
+
+
+class SampleBilinearTest(unittest.TestCase):
+    def setUp(self):
+        self.operator = addon.SendToControlNetOperator()
+        self.pixels = np.arange(3 * 4 * 4, dtype=np.float64).reshape(3, 4, 4)
+
+    def test_pixel_centres_return_pixels(self):
+        colors = self.operator.sample_bilinear(
+            self.pixels, np.array([0.5, 3.5]), np.array([0.5, 2.5])
+        )
+        np.testing.assert_allclose(colors, [self.pixels[0, 0], self.pixels[2, 3]])
+
+    def test_interpolates_between_pixels(self):
+        colors = self.operator.sample_bilinear(
+            self.pixels, np.array([1.0]), np.array([1.0])
+        )
+        expected = self.pixels[:2, :2].reshape(-1, 4).mean(axis=0)
+        np.testing.assert_allclose(colors[0], expected)
+
+    def test_edges_are_clamped(self):
+        colors = self.operator.sample_bilinear(
+            self.pixels, np.array([0.0, 4.0, -3.0]), np.array([0.0, 3.0, 10.0])
+        )
+        np.testing.assert_allclose(
+            colors, [self.pixels[0, 0], self.pixels[2, 3], self.pixels[2, 0]]
+        )
+
+    def test_single_pixel_image(self):
+        pixels = np.ones((1, 1, 4))
+        colors = self.operator.sample_bilinear(
+            pixels, np.array([0.0, 0.7]), np.array([0.3, 1.0])
+        )
+        np.testing.assert_allclose(colors, np.ones((2, 4)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,390 @@
+import base64
+import http.server
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import bpy_shim  # noqa: F401  installs the fake bpy before the add-on import
+import stencil_from_control_net as addon
+
+
+class FaultInjectingHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers with the next fault queued on the server:
+    "503", "500", "drop", "slow" or "ok".
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.answer()
+
+    def answer(self):
+        server = self.server
+        with server.lock:
+            server.hits += 1
+            fault = server.faults.pop(0) if server.faults else "ok"
+        if fault == "drop":
+            self.close_connection = True
+            return
+        if fault == "slow":
+            time.sleep(server.slow_seconds)
+        if fault == "503":
+            self.send_json(503, {"error": "busy"})
+        elif fault == "500":
+            self.send_json(500, {"error": "OutOfMemoryError", "detail": "CUDA OOM"})
+        else:
+            self.send_json(200, {"images": []})
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        try:
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:
+            # The client gave up waiting
+            pass
+
+
+class StubServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FaultInjectingHandler)
+        self.lock = threading.Lock()
+        self.faults = []
+        self.hits = 0
+        self.slow_seconds = 0.5
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SdBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        self.sleeps = []
+        self.clock = FakeClock()
+        self.backend = addon.SdBackend(
+            self.server.base_url,
+            max_retries=3,
+            breaker=addon.SdCircuitBreaker(
+                failure_threshold=5, reset_timeout=30.0, clock=self.clock
+            ),
+            sleep=self.sleeps.append,
+        )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        self.server.faults = ["503", "drop", "503"]
+        self.assertEqual(self.backend.request("/sdapi/v1/sd-models"), {"images": []})
+        self.assertEqual(self.server.hits, 4)
+        self.assertEqual(len(self.sleeps), 3)
+        # Jittered exponential backoff: 1, 2, 4 s scaled into [0.5, 1]
+        for attempt, delay in enumerate(self.sleeps):
+            self.assertGreaterEqual(delay, 0.5 * 2**attempt)
+            self.assertLessEqual(delay, 2**attempt)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.faults = ["503"] * 10
+        with self.assertRaises(addon.SdBackendError):
+            self.backend.request("/sdapi/v1/sd-models")
+        self.assertEqual(self.server.hits, 4)
+
+    def test_rejected_request_is_not_retried(self):
+        self.server.faults = ["500"]
+        with self.assertRaisesRegex(addon.SdBackendError, "CUDA OOM"):
+            self.backend.request("/sdapi/v1/txt2img", {"steps": 20})
+        self.assertEqual(self.server.hits, 1)
+
+    def test_get_timeout_grows_on_retry(self):
+        self.server.slow_seconds = 0.3
+        self.server.faults = ["slow", "slow"]
+        self.assertEqual(
+            self.backend.request("/sdapi/v1/options", timeout=0.2), {"images": []}
+        )
+        # The 0.2 s attempt times out, the retry gets 0.4 s and succeeds
+        self.assertEqual(self.server.hits, 2)
+
+    def test_post_timeout_is_not_resent(self):
+        self.server.slow_seconds = 0.5
+        self.server.faults = ["slow"]
+        with self.assertRaisesRegex(addon.SdBackendError, "may still be generating"):
+            self.backend.request("/sdapi/v1/txt2img", {"steps": 20}, timeout=0.2)
+        time.sleep(0.4)
+        self.assertEqual(self.server.hits, 1)
+
+    def test_timeouts_grow_for_a_slow_webui(self):
+        # The webui stays slower than the first estimate of 0.1 s
+        self.server.slow_seconds = 0.4
+        self.server.faults = ["slow"] * 3
+        self.backend.breaker.failure_threshold = 1
+        self.backend.latency = addon.SdLatencyModel(seconds_per_megapixel_step=0.1)
+        data = {"steps": 1, "width": 1000, "height": 1000}
+        with mock.patch.object(addon, "SD_TIMEOUT_OVERHEAD", 0.0):
+            with self.assertRaises(addon.SdTimeoutError):
+                self.backend.generate("/sdapi/v1/txt2img", data)
+            # A slow webui is not a failed one
+            self.assertEqual(self.backend.breaker.retry_in(), 0.0)
+            self.assertGreaterEqual(self.backend.latency.estimate(1, 1000, 1000), 0.3)
+
+            for _ in range(2):
+                self.assertEqual(
+                    self.backend.generate("/sdapi/v1/txt2img", data), {"images": []}
+                )
+        self.assertEqual(self.server.hits, 3)
+
+    def test_breaker_opens_and_fails_fast(self):
+        self.backend.breaker.failure_threshold = 3
+        self.server.faults = ["503"] * 10
+        with self.assertRaises(addon.SdBackendError):
+            self.backend.request("/sdapi/v1/sd-models")
+        self.assertEqual(self.server.hits, 3)
+
+        with self.assertRaises(addon.SdCircuitOpenError):
+            self.backend.request("/sdapi/v1/sd-models")
+        self.assertEqual(self.server.hits, 3)
+        self.assertEqual(self.backend.breaker.retry_in(), 30.0)
+
+    def test_half_open_trial(self):
+        self.backend.breaker.failure_threshold = 1
+        self.backend.max_retries = 0
+        self.server.faults = ["503", "503"]
+        with self.assertRaises(addon.SdBackendError):
+            self.backend.request("/sdapi/v1/sd-models")
+
+        # A failed trial reopens the circuit
+        self.clock.now = 31.0
+        with self.assertRaises(addon.SdBackendError):
+            self.backend.request("/sdapi/v1/sd-models")
+        self.assertEqual(self.server.hits, 2)
+        with self.assertRaises(addon.SdCircuitOpenError):
+            self.backend.request("/sdapi/v1/sd-models")
+
+        # A successful trial closes it
+        self.clock.now = 62.0
+        self.assertEqual(self.backend.request("/sdapi/v1/sd-models"), {"images": []})
+        self.assertEqual(self.backend.breaker.retry_in(), 0.0)
+        self.assertEqual(self.server.hits, 3)
+
+
+class CheckpointHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Tracks the loaded checkpoint like the webui. switch_after_options makes
+    another client switch the checkpoint right after the next options query.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        body = {"sd_model_checkpoint": server.checkpoint}
+        if server.switch_after_options:
+            server.checkpoint = server.switch_after_options
+            server.switch_after_options = None
+        self.send_json(body)
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.posts.append(payload)
+        override = payload.get("override_settings", {}).get("sd_model_checkpoint")
+        if override:
+            server.checkpoint = override
+        name, short_hash = server.checkpoint.split(" [")
+        info = {
+            "sd_model_name": name.replace(".safetensors", ""),
+            "sd_model_hash": short_hash.rstrip("]"),
+        }
+        self.send_json({"images": [], "info": json.dumps(info)})
+
+    def send_json(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class CheckpointTest(unittest.TestCase):
+    MODEL_A = "a.safetensors [aaaaaaaaaa]"
+    MODEL_B = "b.safetensors [bbbbbbbbbb]"
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), CheckpointHandler
+        )
+        self.server.daemon_threads = True
+        self.server.checkpoint = self.MODEL_A
+        self.server.switch_after_options = None
+        self.server.posts = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.backend = addon.SdBackend(f"http://127.0.0.1:{self.server.server_port}")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_no_override_when_loaded(self):
+        self.backend.generate("/sdapi/v1/txt2img", {"steps": 20}, self.MODEL_A)
+        self.assertNotIn("override_settings", self.server.posts[0])
+        self.assertTrue(self.backend.is_checkpoint_warm(self.MODEL_A))
+
+    def test_stale_cache_does_not_skip_override(self):
+        self.backend.set_loaded_checkpoint(self.MODEL_A)
+        # Another client switches the webui to B
+        self.server.checkpoint = self.MODEL_B
+        self.backend.generate("/sdapi/v1/txt2img", {"steps": 20}, self.MODEL_A)
+        payload = self.server.posts[0]
+        self.assertEqual(
+            payload["override_settings"], {"sd_model_checkpoint": self.MODEL_A}
+        )
+        self.assertFalse(payload["override_settings_restore_afterwards"])
+        self.assertEqual(self.server.checkpoint, self.MODEL_A)
+
+    def test_switch_between_check_and_request_is_resent(self):
+        self.server.switch_after_options = self.MODEL_B
+        self.backend.generate("/sdapi/v1/txt2img", {"steps": 20}, self.MODEL_A)
+        self.assertEqual(len(self.server.posts), 2)
+        self.assertNotIn("override_settings", self.server.posts[0])
+        self.assertIn("override_settings", self.server.posts[1])
+        self.assertTrue(self.backend.is_checkpoint_warm(self.MODEL_A))
+
+    def test_indicator_is_unknown_when_stale(self):
+        self.assertIsNone(self.backend.is_checkpoint_warm(self.MODEL_A))
+        self.backend.set_loaded_checkpoint(self.MODEL_A)
+        self.assertTrue(self.backend.is_checkpoint_warm(self.MODEL_A))
+        self.assertFalse(self.backend.is_checkpoint_warm(self.MODEL_B))
+        self.backend.checkpoint_checked_at -= addon.SD_CHECKPOINT_MAX_AGE
+        self.assertIsNone(self.backend.is_checkpoint_warm(self.MODEL_A))
+
+    def test_checkpoint_matches(self):
+        self.assertTrue(
+            addon.checkpoint_matches("a [aaaaaaaaaa]", "dir/a.safetensors [aaaaaaaaaa]")
+        )
+        self.assertFalse(addon.checkpoint_matches(self.MODEL_A, self.MODEL_B))
+        self.assertTrue(addon.checkpoint_matches("a", "a.ckpt [aaaaaaaaaa]"))
+        self.assertFalse(addon.checkpoint_matches(None, self.MODEL_A))
+
+    def test_group_by_checkpoint_starts_with_loaded(self):
+        jobs = [
+            (self.MODEL_B, 1),
+            (self.MODEL_A, 2),
+            (self.MODEL_B, 3),
+            ("c.safetensors [cccccccccc]", 4),
+            (self.MODEL_A, 5),
+        ]
+        # The loaded title may differ from the stored one but has the same hash
+        groups = addon.group_by_checkpoint(jobs, "a [aaaaaaaaaa]")
+        self.assertEqual(
+            groups,
+            [
+                (self.MODEL_A, [2, 5]),
+                (self.MODEL_B, [1, 3]),
+                ("c.safetensors [cccccccccc]", [4]),
+            ],
+        )
+        # Nothing loaded keeps the submission order
+        self.assertEqual(
+            [checkpoint for checkpoint, _ in addon.group_by_checkpoint(jobs, None)],
+            [self.MODEL_B, self.MODEL_A, "c.safetensors [cccccccccc]"],
+        )
+
+
+class FakeViewBackend:
+    """Answers generations with one image, failing for the given checkpoints."""
+
+    def __init__(self, loaded, failing):
+        self.loaded = loaded
+        self.failing = failing
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_loaded_checkpoint(self):
+        return self.loaded
+
+    def generate(self, path, data, checkpoint=None):
+        with self.lock:
+            self.calls.append(checkpoint)
+        if checkpoint in self.failing:
+            raise addon.SdBackendError("SD request failed: HTTP 500")
+        return {"images": [base64.b64encode(data["tag"].encode()).decode()]}
+
+
+class ViewRequestsTest(unittest.TestCase):
+    def setUp(self):
+        self.operator = addon.SendToControlNetOperator()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        previous_tempdir = addon.bpy.app.tempdir
+        addon.bpy.app.tempdir = self.tempdir.name
+        self.addCleanup(setattr, addon.bpy.app, "tempdir", previous_tempdir)
+
+    def test_failed_view_keeps_finished_results(self):
+        jobs = [
+            (0, "/sdapi/v1/txt2img", {"tag": "zero"}, "b"),
+            (1, "/sdapi/v1/txt2img", {"tag": "one"}, "a"),
+            (2, "/sdapi/v1/txt2img", {"tag": "two"}, "b"),
+            (3, "/sdapi/v1/txt2img", {"tag": "three"}, "c"),
+        ]
+        backend = FakeViewBackend(loaded="a", failing={"b"})
+        results, errors = self.operator.post_view_requests(backend, jobs, 2)
+
+        self.assertEqual(sorted(results), [1, 3])
+        for index, tag in ((1, "one"), (3, "three")):
+            with open(results[index][0], "rb") as image_file:
+                self.assertEqual(image_file.read(), tag.encode())
+        self.assertEqual(sorted(index for index, _ in errors), [0, 2])
+        self.assertTrue(
+            all(isinstance(error, addon.SdBackendError) for _, error in errors)
+        )
+        # The loaded checkpoint runs first, then one group per checkpoint
+        self.assertEqual(backend.calls, ["a", "b", "b", "c"])
+
+
+class SdLatencyModelTest(unittest.TestCase):
+    def test_timeout_scales_with_queue_and_model_load(self):
+        latency = addon.SdLatencyModel(seconds_per_megapixel_step=1.0)
+        single = latency.timeout(20, 1000, 1000)
+        self.assertEqual(
+            single, addon.SD_TIMEOUT_OVERHEAD + addon.SD_TIMEOUT_FACTOR * 20
+        )
+        self.assertGreater(latency.timeout(20, 1000, 1000, queued=3), single)
+        self.assertEqual(
+            latency.timeout(20, 1000, 1000, model_load=True),
+            single + addon.SD_MODEL_LOAD_TIMEOUT,
+        )
+
+    def test_record_moves_estimate_towards_samples(self):
+        latency = addon.SdLatencyModel(seconds_per_megapixel_step=1.0, smoothing=0.5)
+        latency.record(10, 1000, 1000, 30.0)
+        self.assertAlmostEqual(latency.estimate(10, 1000, 1000), 20.0)
+
+
+if __name__ == "__main__":
+    unittest.main()